@@ -16,6 +16,7 @@ It shut down but never gave you a reason why. You are trying to get a refund.
 However, you might consider other offers if the customer service agent is persuasive
 enough. You might accept offers that are 2 to 3 times more valuable than your original
 purchase.
+Every message you receive is the next message from the support agent.
 
 BEHAVIOR
 
@@ -1,11 +1,14 @@
+import asyncio
+
 from pydantic_ai import Agent
 from pydantic_ai.messages import BinaryContent
 
 from multimodal_moderation.types.model_choice import ModelChoice
 from multimodal_moderation.types.moderation_result import VideoModerationResult
+from multimodal_moderation.video_preprocessing import downsample_video, MAX_LONG_EDGE
 
 
-MODERATION_INSTRUCTIONS = """
+MODERATION_INSTRUCTIONS = f"""
 CONTEXT
 At ACME Enterprise we strive for a friendly but professional interaction with our customers.
 
@@ -25,6 +28,11 @@ Detect if:
   pixelated, underexposed, overexposed, etc.). Ignore low-quality portions of the video if
   they do not make up the majority of the video.
 
+Larger videos may have been reduced to about one frame per second and scaled down to at most {MAX_LONG_EDGE} pixels
+on the longest side before you receive them. Do not count the low frame rate, jumps between frames, or
+that resolution as low quality. Judge quality on blur, pixelation, noise and exposure that would still be
+visible at that size.
+
 OUTPUT
 Provide a detailed rationale for your choices.
 """
@@ -44,15 +52,17 @@ async def moderate_video(
     """
     Moderate a video using the configured PydanticAI agent and return a structured result.
     """
+    video_source, media_type = await asyncio.to_thread(downsample_video, video_source, media_type)
+
     video_input = BinaryContent(
         data=video_source,
         media_type=media_type,
     )
 
-    prompt = "Please analyze the following video for moderation."
-
+    # The instructions already describe the task, so only the video is sent per call. This keeps
+    # the static prefix identical across requests for provider-side prompt caching.
     result = await video_moderation_agent.run(
-        [prompt, video_input],
+        [video_input],
         model=model_choice.model,
         model_settings=model_choice.model_settings,
     )
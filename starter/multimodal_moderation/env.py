@@ -25,6 +25,7 @@ EVAL_JUDGE_MODEL: str = os.getenv("EVAL_JUDGE_MODEL", DEFAULT_GOOGLE_MODEL)
 EVAL_NUM_REPEATS: int = int(os.getenv("EVAL_NUM_REPEATS", "1"))
 API_BASE_URL: str = os.getenv("API_BASE_URL", "http://localhost:8000")
 PHOENIX_URL: str = os.getenv("PHOENIX_URL", "http://127.0.0.1:6006")
+TRACE_SAMPLE_RATIO: float = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
 
 
 def get_default_model_choice() -> ModelChoice:
@@ -1,4 +1,6 @@
-from fastapi import Depends, FastAPI, HTTPException, UploadFile, File
+import asyncio
+
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 
@@ -66,6 +68,51 @@ async def moderate_audio_file_endpoint(file: UploadFile = File(...)):
     return await moderate_audio(default_model_choice, file_bytes, mime_type)
 
 
+MEDIA_MODERATORS = {
+    "image": moderate_image,
+    "video": moderate_video,
+    "audio": moderate_audio,
+}
+
+
+async def _moderate_uploaded_file(file: UploadFile):
+    file_bytes = await file.read()
+    try:
+        mime_type = detect_file_type(file_bytes, context=file.filename or "media file")
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    content_type = mime_type.split("/")[0]
+    if content_type not in MEDIA_MODERATORS:
+        raise HTTPException(status_code=415, detail=f"Unsupported media type: {mime_type}")
+    return await MEDIA_MODERATORS[content_type](default_model_choice, file_bytes, mime_type)
+
+
+# Moderates several inputs in one round-trip. Results are returned in input order: texts first, then files.
+@app.post(
+    "/api/v1/moderate_batch",
+    response_model=list[TextModerationResult | ImageModerationResult | VideoModerationResult | AudioModerationResult],
+)
+async def moderate_batch_endpoint(texts: list[str] = Form(default=[]), files: list[UploadFile] = File(default=[])):
+    # A TaskGroup cancels the remaining model calls as soon as one input fails, so a rejected
+    # upload does not leave sibling requests running for a response nobody reads
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(moderate_text(default_model_choice, text)) for text in texts]
+            tasks += [tg.create_task(_moderate_uploaded_file(file)) for file in files]
+    except ExceptionGroup as group:
+        # A rejected upload takes precedence so the client gets its 4xx; a single other
+        # failure is re-raised as-is rather than wrapped in an ExceptionGroup
+        rejected = group.subgroup(HTTPException)
+        if rejected is not None:
+            raise rejected.exceptions[0] from None
+        if len(group.exceptions) == 1:
+            raise group.exceptions[0] from None
+        raise
+
+    return [task.result() for task in tasks]
+
+
 @app.get("/api/v1/health")
 async def health_check():
     return {"status": "ok"}
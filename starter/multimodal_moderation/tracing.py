@@ -3,23 +3,27 @@ import shutil
 from pathlib import Path
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from openinference.instrumentation.pydantic_ai import OpenInferenceSpanProcessor
-from multimodal_moderation.env import PHOENIX_URL
+from multimodal_moderation.env import PHOENIX_URL, TRACE_SAMPLE_RATIO
 
 
 def setup_tracing():
     """Initialize OpenTelemetry tracing with Phoenix backend for observability."""
-    tracer_provider = TracerProvider()
+    # Sample a fraction of traces at the root; child spans follow their parent's decision so
+    # traces are never partially recorded
+    tracer_provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)))
     trace.set_tracer_provider(tracer_provider)
 
     # Add OpenInference processor for AI-specific span processing
     tracer_provider.add_span_processor(OpenInferenceSpanProcessor())
 
-    # Add OTLP exporter to send traces to Phoenix
+    # Add OTLP exporter to send traces to Phoenix. Spans are exported from a background thread
+    # so ending a span never blocks the request on a network call.
     exporter = OTLPSpanExporter(endpoint=f"{PHOENIX_URL}/v1/traces")
-    tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer_provider.add_span_processor(BatchSpanProcessor(exporter))
 
 
 def get_tracer(name: str):
@@ -27,7 +31,7 @@ def get_tracer(name: str):
     return trace.get_tracer(name)
 
 
-def add_media_to_span(span: trace.Span, file_path: str, media_type: str, index: int):
+def add_media_to_span(span: trace.Span, file_path: str, media_type: str, index: int, data: bytes | None = None):
     """
     Save uploaded media file and add metadata to the tracing span.
 
@@ -38,7 +42,12 @@ def add_media_to_span(span: trace.Span, file_path: str, media_type: str, index:
         file_path: Path to the uploaded media file
         media_type: Type of media (e.g., "image_moderation", "video_moderation")
         index: Index of this media file (for handling multiple files)
+        data: Contents of the file, if already read, to avoid reading it again
     """
+    # Copying the file is wasted work for spans that will never be exported
+    if not span.is_recording():
+        return
+
     try:
         # Create directory to store uploaded media files
         uploads_dir = Path("./uploaded_media")
@@ -48,14 +57,19 @@ def add_media_to_span(span: trace.Span, file_path: str, media_type: str, index:
         source_path = Path(file_path)
         timestamp = str(uuid.uuid4())[:8]
         dest_path = uploads_dir / f"{timestamp}_{source_path.name}"
-        shutil.copy(file_path, dest_path)
+        if data is not None:
+            dest_path.write_bytes(data)
+            size_bytes = len(data)
+        else:
+            shutil.copy(file_path, dest_path)
+            size_bytes = source_path.stat().st_size
 
         # Add file metadata to span for Phoenix visualization
         absolute_path = dest_path.resolve()
         span.set_attributes({
             f"input.{media_type}.{index}.url": f"file://{absolute_path}",
             f"input.{media_type}.{index}.filename": source_path.name,
-            f"input.{media_type}.{index}.size_bytes": source_path.stat().st_size,
+            f"input.{media_type}.{index}.size_bytes": size_bytes,
         })
     except Exception:
         # Silently fail - tracing should not break the app
@@ -1,10 +1,20 @@
 import os
-import requests
+import re
+import string
+import asyncio
+import httpx
+import orjson
 import gradio as gr
-import uuid
+import secrets
+import hashlib
+import functools
+import contextlib
+import weakref
 from typing import List, Tuple, Any
 import logging
+from pathlib import Path
 
+from cachetools import TTLCache
 from pydantic_ai.messages import BinaryContent
 from opentelemetry import trace
 
@@ -26,6 +36,27 @@ tracer = get_tracer(__name__)
 MAX_FILE_SIZE_MB = 5
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
+# Shared across chat turns so moderation calls reuse pooled keep-alive connections and can be
+# multiplexed over HTTP/2. The transport retries failed connection attempts; transient 5xx
+# responses are retried in _post_moderation. Media and batch moderation wait on server-side LLM
+# calls, so reads get a generous timeout while unreachable servers still fail fast on connect.
+_http_client = httpx.AsyncClient(
+    headers={"Authorization": f"Bearer {USER_API_KEY}"},
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        retries=3,
+    ),
+)
+
+RETRY_STATUS_CODES = {502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.2
+
+# Moderation results keyed by the SHA-256 of the moderated payload, so repeated content skips the API entirely
+_moderation_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
 
 # -------------------------------------------------------------------
 # Moderation config
@@ -49,76 +80,348 @@ MODERATION_CONFIG = {
     },
 }
 
+# Moderates several texts and files in one round-trip. Older servers without it answer 404,
+# in which case each input is moderated through its per-modality endpoint instead.
+BATCH_MODERATION_ENDPOINT = f"{API_BASE_URL}/api/v1/moderate_batch"
+_batch_endpoint_available = True
+
+# A few plain greetings, and messages made only of a couple of ASCII punctuation marks, cannot trip
+# any text flag, so they skip the moderation API. Other short messages (e.g. a single emoji) can be
+# rude and are always moderated.
+_TRIVIAL_TEXT_RE = re.compile(r"^(hi|hello|thanks|ok)\.?$", re.IGNORECASE)
+_TRIVIAL_TEXT_MODERATION = (
+    {**{flag: False for flag in MODERATION_CONFIG["text"]["unsafe_flags"]}, "rationale": ""},
+    "",
+    "text",
+    "text/plain",
+)
+
 
 # -------------------------------------------------------------------
 # Moderation helpers
 # -------------------------------------------------------------------
-def _call_text_moderation(text: str, span: trace.Span):
-    response = requests.post(
-        MODERATION_CONFIG["text"]["endpoint"],
-        headers={"Authorization": f"Bearer {USER_API_KEY}"},
-        json={"text": text},
-    )
-    if not response.ok:
-        raise RuntimeError(response.text)
+# Strong references to fire-and-forget tasks so they are not garbage-collected before finishing
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _record_media_in_background(parent: trace.Span, media: str, data: bytes, media_type: str, index: int):
+    """
+    Save an uploaded file for Phoenix off the request path.
+
+    The media attributes go on a child span that the background task ends itself, so recording
+    them does not depend on the moderation span still being open.
+    """
+    if not parent.is_recording():
+        return
 
+    span = tracer.start_span(f"record_{media_type}", context=trace.set_span_in_context(parent))
+
+    def record():
+        try:
+            add_media_to_span(span, media, media_type, index, data=data)
+        finally:
+            span.end()
+
+    task = asyncio.create_task(asyncio.to_thread(record))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _post_moderation(endpoint: str, **kwargs) -> httpx.Response:
+    for attempt in range(MAX_RETRIES + 1):
+        response = await _http_client.post(endpoint, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+            return response
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2**attempt)
+
+
+def _is_trivial_text(text: str) -> bool:
+    stripped = text.strip()
+    if len(stripped) < 3 and all(char in string.punctuation for char in stripped):
+        return True
+    return _TRIVIAL_TEXT_RE.match(stripped) is not None
+
+
+def _content_hash(kind: str, payload: bytes) -> str:
+    return f"{kind}:{hashlib.sha256(payload).hexdigest()}"
+
+
+async def _call_text_moderation(text: str, span: trace.Span):
     span.set_attributes(
         {
             "input.text.length": len(text),
         }
     )
 
-    result = response.json()
-    return result, result["rationale"], "text", "text/plain"
+    cache_key = _content_hash("text", text.encode())
+    cached = _moderation_cache.get(cache_key)
+    span.set_attribute("moderation.cache_hit", cached is not None)
+    if cached is not None:
+        return cached
 
+    response = await _post_moderation(
+        MODERATION_CONFIG["text"]["endpoint"],
+        content=orjson.dumps({"text": text}),
+        headers={"Content-Type": "application/json"},
+    )
+    if not response.is_success:
+        raise RuntimeError(response.text)
 
-def _call_media_moderation(media: str, span: trace.Span):
-    mime_type = detect_file_type(media, context=media)
-    content_type = mime_type.split("/")[0]
+    result = orjson.loads(response.content)
+    moderation = result, result["rationale"], "text", "text/plain"
+    _moderation_cache[cache_key] = moderation
+    return moderation
 
-    file_size = os.path.getsize(media)
-    if file_size > MAX_FILE_SIZE_BYTES:
-        raise ValueError("File too large")
 
-    with open(media, "rb") as f:
-        response = requests.post(
-            MODERATION_CONFIG[content_type]["endpoint"],
-            headers={"Authorization": f"Bearer {USER_API_KEY}"},
-            files={"file": f},
-        )
+async def _call_media_moderation(media: str, data: bytes, mime_type: str, span: trace.Span):
+    cache_key = _content_hash("media", data)
+    cached = _moderation_cache.get(cache_key)
+    span.set_attribute("moderation.cache_hit", cached is not None)
+    if cached is not None:
+        return cached
 
-    if not response.ok:
+    content_type = mime_type.split("/")[0]
+
+    # httpx streams the multipart body and yields these bytes as-is, so the upload adds no copy of the
+    # file on top of the single buffer shared with the cache key, tracing and the LLM prompt
+    response = await _post_moderation(
+        MODERATION_CONFIG[content_type]["endpoint"],
+        files={"file": (os.path.basename(media), data, mime_type)},
+    )
+
+    if not response.is_success:
         raise RuntimeError(response.text)
 
-    add_media_to_span(span, media, f"{content_type}_moderation", 0)
+    _record_media_in_background(span, media, data, f"{content_type}_moderation", 0)
+
+    result = orjson.loads(response.content)
+    moderation = result, _media_feedback(content_type, result), content_type, mime_type
+    _moderation_cache[cache_key] = moderation
+    return moderation
+
 
-    result = response.json()
+def _media_feedback(content_type: str, result: dict) -> str:
     feedback = result["rationale"]
 
     if content_type == "audio" and "transcription" in result:
         feedback = f"Transcription: \"{result['transcription']}\"\n\n{feedback}"
 
-    return result, feedback, content_type, mime_type
+    return feedback
+
+
+async def _call_batch_moderation(texts: List[str], media: List[Tuple[str, bytes, str]], span: trace.Span):
+    """
+    Moderate all texts and (path, bytes, mime_type) media items with a single request.
+
+    Results are returned in input order (texts first, then media) as the same tuples the per-item
+    helpers return. Cached items are not resent. Returns None if the server has no batch endpoint.
+    """
+    global _batch_endpoint_available
+
+    cache_keys = [
+        *(_content_hash("text", text.encode()) for text in texts),
+        *(_content_hash("media", data) for _, data, _ in media),
+    ]
+    moderations = [_moderation_cache.get(cache_key) for cache_key in cache_keys]
+    for i, text in enumerate(texts):
+        if _is_trivial_text(text):
+            moderations[i] = _TRIVIAL_TEXT_MODERATION
+    missing = [i for i, moderation in enumerate(moderations) if moderation is None]
+
+    span.set_attributes(
+        {
+            "input.batch.size": len(cache_keys),
+            "moderation.skipped": len(cache_keys) - len(missing),
+        }
+    )
+
+    if not missing:
+        return moderations
 
+    response = await _post_moderation(
+        BATCH_MODERATION_ENDPOINT,
+        data={"texts": [texts[i] for i in missing if i < len(texts)]},
+        files=[
+            ("files", (os.path.basename(path), data, mime_type))
+            for path, data, mime_type in (media[i - len(texts)] for i in missing if i >= len(texts))
+        ],
+    )
+
+    if response.status_code == 404:
+        _batch_endpoint_available = False
+        return None
+
+    if not response.is_success:
+        raise RuntimeError(response.text)
+
+    results = orjson.loads(response.content)
+    if len(results) != len(missing):
+        raise RuntimeError(f"Batch moderation returned {len(results)} results for {len(missing)} inputs")
+
+    for i, result in zip(missing, results):
+        if i < len(texts):
+            moderation = result, result["rationale"], "text", "text/plain"
+        else:
+            media_index = i - len(texts)
+            path, data, mime_type = media[media_index]
+            content_type = mime_type.split("/")[0]
+            _record_media_in_background(span, path, data, f"{content_type}_moderation", media_index)
+            moderation = result, _media_feedback(content_type, result), content_type, mime_type
+
+        _moderation_cache[cache_keys[i]] = moderation
+        moderations[i] = moderation
+
+    return moderations
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_mime(path: str, mtime: float, size: int) -> str:
+    # mtime and size are part of the cache key so a file rewritten in place is sniffed again
+    return detect_file_type(path, context=path)
+
+
+async def _preflight_media(file_paths: List[str]) -> List[str]:
+    """
+    Validate every upload of a turn up front and return their MIME types in input order.
+
+    All files are stat'ed concurrently and the size limit is checked in one pass, so an oversized
+    file fails the turn before any moderation request is sent. MIME types are then sniffed
+    concurrently, reusing the stat results.
+    """
+    stats = await asyncio.gather(*(asyncio.to_thread(os.stat, file_path) for file_path in file_paths))
+
+    if any(stat.st_size > MAX_FILE_SIZE_BYTES for stat in stats):
+        raise ValueError("File too large")
+
+    return await asyncio.gather(
+        *(
+            asyncio.to_thread(_cached_mime, file_path, stat.st_mtime, stat.st_size)
+            for file_path, stat in zip(file_paths, stats)
+        )
+    )
+
+
+async def check_content_safety(*, text=None, media=None, data=None, mime_type=None):
+    if text is not None and _is_trivial_text(text):
+        return True, "", "text/plain"
 
-def check_content_safety(*, text=None, media=None):
     with tracer.start_as_current_span("moderate_text") as span:
 
         if text is not None:
-            result, feedback, content_type, mime_type = _call_text_moderation(text, span)
+            result, feedback, content_type, mime_type = await _call_text_moderation(text, span)
         elif media is not None:
-            result, feedback, content_type, mime_type = _call_media_moderation(media, span)
+            if mime_type is None:
+                (mime_type,) = await _preflight_media([media])
+            if data is None:
+                data = await asyncio.to_thread(Path(media).read_bytes)
+            result, feedback, content_type, mime_type = await _call_media_moderation(media, data, mime_type, span)
         else:
             raise ValueError("Must provide text or media")
 
         span.set_attributes({f"output.{k}": v for k, v in result.items()})
         span.update_name(f"moderate_{content_type}")
 
-    for flag in MODERATION_CONFIG[content_type]["unsafe_flags"]:
-        if result[flag]:
-            return False, feedback, mime_type
+    return _is_safe(content_type, result), feedback, mime_type
+
 
-    return True, feedback, mime_type
+def _is_safe(content_type: str, result: dict) -> bool:
+    return not any(result[flag] for flag in MODERATION_CONFIG[content_type]["unsafe_flags"])
+
+
+class _ContentFlagged(Exception):
+    """Raised inside a moderation task to cancel the rest of the turn's moderation."""
+
+    def __init__(self, feedback: str):
+        super().__init__(feedback)
+        self.feedback = feedback
+
+
+async def _moderate_text_input(text: str) -> Tuple[str, str]:
+    is_safe, feedback, _ = await check_content_safety(text=text)
+    if not is_safe:
+        raise _ContentFlagged(feedback)
+    return text, feedback
+
+
+async def _moderate_file_input(file_path: str, mime_type: str) -> Tuple[BinaryContent, str]:
+    # The file is read once and the same bytes are used for moderation and for the LLM prompt
+    file_bytes = await asyncio.to_thread(Path(file_path).read_bytes)
+    is_safe, feedback, mime_type = await check_content_safety(media=file_path, data=file_bytes, mime_type=mime_type)
+    if not is_safe:
+        raise _ContentFlagged(feedback)
+    return BinaryContent(data=file_bytes, media_type=mime_type), feedback
+
+
+async def _moderate_inputs_batched(texts: List[str], file_paths: List[str], mime_types: List[str]):
+    files_bytes = await asyncio.gather(
+        *(asyncio.to_thread(Path(file_path).read_bytes) for file_path in file_paths)
+    )
+    files_data = list(zip(files_bytes, mime_types))
+    media = [(file_path, file_bytes, mime_type) for file_path, (file_bytes, mime_type) in zip(file_paths, files_data)]
+
+    with tracer.start_as_current_span("moderate_batch") as span:
+        moderations = await _call_batch_moderation(texts, media, span)
+
+        # Mirror the per-item moderate_{type} spans so Phoenix shows each decision in batched turns too
+        for moderation in moderations or []:
+            if moderation is _TRIVIAL_TEXT_MODERATION:
+                continue
+            result, _, content_type, _ = moderation
+            with tracer.start_as_current_span(f"moderate_{content_type}") as item_span:
+                item_span.set_attributes({f"output.{k}": v for k, v in result.items()})
+
+    if moderations is None:
+        return None
+
+    for result, feedback, content_type, _ in moderations:
+        if not _is_safe(content_type, result):
+            raise _ContentFlagged(feedback)
+
+    # Prompt parts are only built once the whole turn has passed moderation. BinaryContent keeps a
+    # reference to the bytes read from disk rather than copying them.
+    parts = [*texts, *(BinaryContent(data=file_bytes, media_type=mime_type) for file_bytes, mime_type in files_data)]
+    return [(part, feedback) for part, (_, feedback, _, _) in zip(parts, moderations)]
+
+
+async def _moderate_turn_inputs(texts: List[str], file_paths: List[str]) -> List[Tuple[str | BinaryContent, str]]:
+    """
+    Moderate every input of a chat turn and return (prompt_part, feedback) pairs in input order.
+
+    Multiple inputs are sent in a single batch request when the server supports it. Otherwise
+    every input is read and moderated in its own task, so the turn waits for the slowest item
+    rather than the sum, and the first flagged item cancels the remaining tasks.
+
+    Raises:
+        _ContentFlagged: if any input fails moderation
+        ValueError: if any file is too large or of an unsupported type
+    """
+    mime_types = await _preflight_media(file_paths)
+
+    if _batch_endpoint_available and len(texts) + len(file_paths) > 1:
+        moderated = await _moderate_inputs_batched(texts, file_paths, mime_types)
+        if moderated is not None:
+            return moderated
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                *(tg.create_task(_moderate_text_input(text)) for text in texts),
+                *(
+                    tg.create_task(_moderate_file_input(file_path, mime_type))
+                    for file_path, mime_type in zip(file_paths, mime_types)
+                ),
+            ]
+    except ExceptionGroup as group:
+        # A flagged input takes precedence over other failures in the same turn; a single other
+        # failure is re-raised as-is rather than wrapped in an ExceptionGroup
+        flagged = group.subgroup(_ContentFlagged)
+        if flagged is not None:
+            raise flagged.exceptions[0] from None
+        if len(group.exceptions) == 1:
+            raise group.exceptions[0] from None
+        raise
+
+    return [task.result() for task in tasks]
 
 
 # -------------------------------------------------------------------
@@ -126,59 +429,59 @@ def check_content_safety(*, text=None, media=None):
 # -------------------------------------------------------------------
 class ChatSessionWithTracing:
     def __init__(self):
-        self.session_id = str(uuid.uuid4())
-        self.conversation_span = tracer.start_span(
-            "conversation",
-            attributes={"session.id": self.session_id},
-        )
+        self.session_id = secrets.token_hex(16)
+        self.conversation_span = None
+        self.conversation_context = None
+
+        # Ends the conversation span on end_conversation, or when the session is garbage-collected
+        self._exit_stack = contextlib.ExitStack()
+        weakref.finalize(self, self._exit_stack.close)
+
+    def _get_conversation_context(self):
+        # The conversation span is only started on the first message, so idle sessions never create one.
+        # Every chat turn is parented to it, so the context is built once.
+        if self.conversation_context is None:
+            self.conversation_span = tracer.start_span(
+                "conversation",
+                attributes={"session.id": self.session_id},
+            )
+            self._exit_stack.callback(self.conversation_span.end)
+            self.conversation_context = trace.set_span_in_context(self.conversation_span)
+        return self.conversation_context
 
     async def chat_with_gemini(self, message, history, past_messages):
         with tracer.start_as_current_span(
             "chat_turn",
-            context=trace.set_span_in_context(self.conversation_span),
+            context=self._get_conversation_context(),
         ) as span:
 
-            prompt_parts: List[str | BinaryContent] = [
-                "This is the next message from the support agent:"
-            ]
+            # The system prompt tells the customer agent who is speaking, so only the message is sent
+            prompt_parts: List[str | BinaryContent] = []
 
-            safety_message = ""
+            texts: List[str] = []
+            file_paths: List[str] = []
 
             for key, value in message.items():
                 if key == "text" and value:
-                    is_safe, safety_message, _ = check_content_safety(text=value)
-                    if not is_safe:
-                        feedback = f"⚠️ Content flagged: {safety_message}"
-                        span.set_attribute("feedback", feedback)
-                        return (
-                            "[Content blocked by moderation]",
-                            past_messages,
-                            feedback,
-                        )
-                    prompt_parts.append(value)
-
+                    texts.append(value)
                 elif key == "files" and value:
-                    for file_path in value:
-                        is_safe, safety_message, mime_type = check_content_safety(
-                            media=file_path
-                        )
-                        if not is_safe:
-                            feedback = f"⚠️ Content flagged: {safety_message}"
-                            return (
-                                "[Content blocked by moderation]",
-                                past_messages,
-                                feedback,
-                            )
-
-                        with open(file_path, "rb") as f:
-                            file_bytes = f.read()
-
-                        prompt_parts.append(
-                            BinaryContent(
-                                data=file_bytes,
-                                media_type=mime_type,
-                            )
-                        )
+                    file_paths.extend(value)
+
+            try:
+                moderated = await _moderate_turn_inputs(texts, file_paths)
+            except _ContentFlagged as flagged:
+                feedback = f"⚠️ Content flagged: {flagged.feedback}"
+                span.set_attribute("feedback", feedback)
+                return (
+                    "[Content blocked by moderation]",
+                    past_messages,
+                    feedback,
+                )
+
+            safety_message = ""
+
+            for part, safety_message in moderated:
+                prompt_parts.append(part)
 
             with tracer.start_as_current_span("llm_customer"):
                 result = await customer_agent.run(
@@ -186,11 +489,15 @@ class ChatSessionWithTracing:
                     message_history=past_messages,
                 )
 
-            return result.output, result.all_messages(), safety_message
+            # Only this turn's messages are appended, so the history isn't rebuilt from scratch every turn
+            past_messages.extend(result.new_messages())
+
+            return result.output, past_messages, safety_message
 
     def end_conversation(self):
-        if self.conversation_span:
-            self.conversation_span.end()
+        self._exit_stack.close()
+        self.conversation_span = None
+        self.conversation_context = None
         return "Conversation ended."
 
 
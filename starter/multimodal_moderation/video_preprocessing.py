@@ -0,0 +1,167 @@
+import io
+from fractions import Fraction
+
+import av
+import numpy as np
+from numba import njit, prange
+
+
+# Videos below this size are already cheap to moderate and are sent as-is
+SMALL_VIDEO_BYTES = 256 * 1024
+
+TARGET_FPS = 1
+MAX_LONG_EDGE = 512
+OUTPUT_CRF = 18
+
+# Mean absolute per-channel pixel change (0-255) accumulated since the last retained frame
+# before a frame is considered visually new
+KEYFRAME_DIFF_THRESHOLD = 8.0
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def select_keyframes(frames: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Return a boolean mask of the frames in a (T, H, W, 3) uint8 array worth keeping.
+
+    Differences between consecutive frames are independent and computed in parallel. The
+    retained set is then chosen in a cheap sequential pass: a frame is kept once the change
+    accumulated since the last retained frame reaches the threshold.
+    """
+    num_frames, height, width, channels = frames.shape
+    diffs = np.zeros(num_frames, dtype=np.float64)
+
+    for t in prange(1, num_frames):
+        total = 0.0
+        for i in range(height):
+            for j in range(width):
+                for c in range(channels):
+                    total += abs(np.float64(frames[t, i, j, c]) - np.float64(frames[t - 1, i, j, c]))
+        diffs[t] = total / (height * width * channels)
+
+    keep = np.zeros(num_frames, dtype=np.bool_)
+    if num_frames == 0:
+        return keep
+
+    keep[0] = True
+    accumulated = 0.0
+    for t in range(1, num_frames):
+        accumulated += diffs[t]
+        if accumulated >= threshold:
+            keep[t] = True
+            accumulated = 0.0
+
+    return keep
+
+
+# Compile at import so the first moderation request does not pay the JIT cost
+select_keyframes(np.zeros((2, 2, 2, 3), dtype=np.uint8), KEYFRAME_DIFF_THRESHOLD)
+
+
+def _scaled_size(width: int, height: int) -> tuple[int, int]:
+    if width <= 0 or height <= 0:
+        raise ValueError("Video stream has no frame dimensions")
+
+    scale = min(1.0, MAX_LONG_EDGE / max(width, height))
+    # libx264 with yuv420p requires even dimensions
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+def _transcode_keyframes(video_source: bytes) -> bytes:
+    output = io.BytesIO()
+
+    with av.open(io.BytesIO(video_source)) as source:
+        in_stream = source.streams.video[0]
+        # Only decode I-frames: they are self-contained and much cheaper to decode
+        in_stream.codec_context.skip_frame = "NONKEY"
+        # Speech and sound are part of what gets moderated, so the audio track is carried over
+        in_audio = source.streams.audio[0] if source.streams.audio else None
+
+        width, height = _scaled_size(in_stream.codec_context.width, in_stream.codec_context.height)
+
+        with av.open(output, mode="w", format="mp4") as target:
+            out_stream = target.add_stream("libx264", rate=TARGET_FPS)
+            out_stream.width = width
+            out_stream.height = height
+            out_stream.pix_fmt = "yuv420p"
+            # Near-visually-lossless quality, so re-encoding adds no compression artifacts of its own
+            # that the moderation model could mistake for a low-quality source
+            out_stream.options = {"crf": str(OUTPUT_CRF)}
+            out_stream.codec_context.time_base = Fraction(1, TARGET_FPS)
+
+            # Re-encoded rather than copied, since not every source audio codec can be muxed into mp4
+            out_audio = None
+            if in_audio is not None:
+                out_audio = target.add_stream("aac", rate=in_audio.codec_context.sample_rate)
+
+            last_time = None
+            decoded = []
+
+            for packet in source.demux(*[s for s in (in_stream, in_audio) if s is not None]):
+                if packet.stream is in_audio:
+                    for audio_frame in packet.decode():
+                        audio_frame.pts = None
+                        for audio_packet in out_audio.encode(audio_frame):
+                            target.mux(audio_packet)
+                    continue
+
+                for frame in packet.decode():
+                    if frame.time is None:
+                        continue
+                    if last_time is not None and frame.time - last_time < 1 / TARGET_FPS:
+                        continue
+                    last_time = frame.time
+                    decoded.append(frame.to_ndarray(width=width, height=height, format="rgb24"))
+
+            if not decoded:
+                raise ValueError("No keyframes could be decoded from the video")
+
+            frames = np.stack(decoded)
+            frames = frames[select_keyframes(frames, KEYFRAME_DIFF_THRESHOLD)]
+
+            for frame_count, pixels in enumerate(frames):
+                frame = av.VideoFrame.from_ndarray(pixels, format="rgb24").reformat(format="yuv420p")
+                frame.pts = frame_count
+                frame.time_base = out_stream.codec_context.time_base
+
+                for packet in out_stream.encode(frame):
+                    target.mux(packet)
+
+            for packet in out_stream.encode():
+                target.mux(packet)
+
+            if out_audio is not None:
+                for audio_packet in out_audio.encode():
+                    target.mux(audio_packet)
+
+    return output.getvalue()
+
+
+def downsample_video(video_source: bytes, media_type: str) -> tuple[bytes, str]:
+    """
+    Reduce a video to at most one keyframe per second at no more than 512px on the long edge,
+    dropping keyframes that are near-duplicates of the previously retained one. The audio track,
+    if any, is kept in full.
+
+    The moderation LLM is billed per frame token, so near-duplicate full-resolution frames add cost
+    without improving the decision. Small inputs, and videos that cannot be decoded or would not get
+    smaller, are returned unchanged so preprocessing never causes a moderation request to fail.
+
+    Args:
+        video_source: Raw bytes of the uploaded video
+        media_type: MIME type of the uploaded video
+
+    Returns:
+        A (video_bytes, media_type) tuple ready to be wrapped in a BinaryContent
+    """
+    if len(video_source) < SMALL_VIDEO_BYTES:
+        return video_source, media_type
+
+    try:
+        downsampled = _transcode_keyframes(video_source)
+    except (av.error.FFmpegError, ValueError, IndexError):
+        return video_source, media_type
+
+    if len(downsampled) >= len(video_source):
+        return video_source, media_type
+
+    return downsampled, "video/mp4"
@@ -0,0 +1,114 @@
+"""
+Tests for the batch moderation endpoint of the FastAPI app.
+
+These tests verify request handling only: the moderation agents are mocked,
+so no model is called. They check that results come back in input order
+(texts first, then files) and that unsupported uploads are rejected.
+"""
+
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+from multimodal_moderation import fastapi_app
+from multimodal_moderation.env import USER_API_KEY
+from multimodal_moderation.types.moderation_result import ImageModerationResult, TextModerationResult
+
+client = TestClient(fastapi_app.app, headers={"Authorization": f"Bearer {USER_API_KEY}"})
+
+
+def _text_result(model_choice, text):
+    return TextModerationResult(
+        rationale=f"text:{text}",
+        contains_pii=False,
+        is_unfriendly=False,
+        is_unprofessional=False,
+    )
+
+
+def _image_result(model_choice, image_source, media_type):
+    return ImageModerationResult(
+        rationale=f"image:{media_type}",
+        contains_pii=False,
+        is_disturbing=False,
+        is_low_quality=False,
+    )
+
+
+def _load_test_image():
+    """Helper to load the test image as bytes"""
+    return (Path(__file__).parent / "test_data" / "simple_image.jpg").read_bytes()
+
+
+def test_moderate_batch_returns_results_in_input_order():
+    """Verify that mixed texts and files are moderated and returned texts first, then files"""
+    with patch.object(fastapi_app, "moderate_text", new=AsyncMock(side_effect=_text_result)), \
+            patch.dict(fastapi_app.MEDIA_MODERATORS, {"image": AsyncMock(side_effect=_image_result)}):
+        response = client.post(
+            "/api/v1/moderate_batch",
+            data={"texts": ["first", "second"]},
+            files=[("files", ("simple_image.jpg", _load_test_image(), "image/jpeg"))],
+        )
+
+    assert response.status_code == 200, response.text
+    assert [item["rationale"] for item in response.json()] == ["text:first", "text:second", "image:image/jpeg"], \
+        "Results should be returned in input order: texts first, then files"
+
+
+def test_moderate_batch_accepts_texts_only():
+    """Verify that a batch without files is accepted"""
+    with patch.object(fastapi_app, "moderate_text", new=AsyncMock(side_effect=_text_result)):
+        response = client.post("/api/v1/moderate_batch", data={"texts": ["only", "texts"]})
+
+    assert response.status_code == 200, response.text
+    assert [item["rationale"] for item in response.json()] == ["text:only", "text:texts"]
+
+
+def test_moderate_batch_rejects_unsupported_media():
+    """Verify that a file which is not image, video or audio is rejected with 415"""
+    with patch.object(fastapi_app, "moderate_text", new=AsyncMock(side_effect=_text_result)):
+        response = client.post(
+            "/api/v1/moderate_batch",
+            data={"texts": ["hello there"]},
+            files=[("files", ("document.pdf", b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n", "application/pdf"))],
+        )
+
+    assert response.status_code == 415, "Unsupported uploads should be rejected with 415"
+
+
+def test_moderate_batch_cancels_pending_moderation_on_rejected_upload():
+    """Verify that a rejected upload cancels the other in-flight moderation calls"""
+    cancelled = []
+
+    async def slow_text_result(model_choice, text):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(text)
+            raise
+
+    # Keep the event loop alive across the request, so leftover tasks are not cancelled by its shutdown
+    with TestClient(fastapi_app.app, headers=client.headers) as persistent_client, \
+            patch.object(fastapi_app, "moderate_text", new=AsyncMock(side_effect=slow_text_result)):
+        response = persistent_client.post(
+            "/api/v1/moderate_batch",
+            data={"texts": ["still running"]},
+            files=[("files", ("document.pdf", b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n", "application/pdf"))],
+        )
+
+        assert response.status_code == 415, "The rejected upload should determine the response"
+        assert cancelled == ["still running"], "Pending text moderation should be cancelled with the request"
+
+
+def test_moderate_batch_declares_response_model():
+    """Verify that the batch route documents its result types in the OpenAPI schema"""
+    schema = client.get("/openapi.json").json()
+    response_schema = schema["paths"]["/api/v1/moderate_batch"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+
+    assert response_schema["type"] == "array"
+    referenced = {option["$ref"].rsplit("/", 1)[-1] for option in response_schema["items"]["anyOf"]}
+    assert referenced == {
+        "TextModerationResult", "ImageModerationResult", "VideoModerationResult", "AudioModerationResult"
+    }
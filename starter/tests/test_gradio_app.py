@@ -6,11 +6,34 @@ and integrate the chat functionality properly. Tests run without launching
 the UI server by inspecting the component tree and mocking dependencies.
 """
 
+import asyncio
+import orjson
 import pytest
+from pathlib import Path
 from unittest.mock import AsyncMock, patch, MagicMock
 import gradio as gr
+from opentelemetry import trace
 
-from multimodal_moderation.gradio_app import create_chat_interface, ChatSessionWithTracing
+from multimodal_moderation.types import gradio_app
+from multimodal_moderation.types.gradio_app import create_chat_interface, ChatSessionWithTracing
+
+
+SAFE_TEXT_RESULT = {
+    "is_unfriendly": False,
+    "is_unprofessional": False,
+    "contains_pii": False,
+    "rationale": "Friendly and professional",
+}
+
+
+def _mock_moderation_response(payload, status_code=200):
+    """Helper to build a moderation API response carrying the given JSON payload"""
+    response = MagicMock()
+    response.status_code = status_code
+    response.is_success = 200 <= status_code < 300
+    response.content = orjson.dumps(payload)
+    response.text = response.content.decode()
+    return response
 
 
 def test_create_chat_interface_returns_blocks():
@@ -113,15 +136,15 @@ def test_multimodal_textbox_accepts_correct_file_types():
 async def test_chat_with_gemini_calls_moderation():
     """Verify that chat_with_gemini integrates with moderation service"""
     # Mock the moderation API
-    with patch('multimodal_moderation.gradio_app.check_content_safety') as mock_moderation:
+    with patch('multimodal_moderation.types.gradio_app.check_content_safety') as mock_moderation:
         # Mock successful moderation
         mock_moderation.return_value = (True, "Content passed moderation", "text/plain")
 
         # Mock the agent run
-        with patch('multimodal_moderation.gradio_app.customer_agent.run') as mock_agent:
+        with patch('multimodal_moderation.types.gradio_app.customer_agent.run') as mock_agent:
             mock_result = MagicMock()
             mock_result.output = "AI response"
-            mock_result.all_messages.return_value = []
+            mock_result.new_messages.return_value = []
             mock_agent.return_value = mock_result
 
             message = {"text": "Hello"}
@@ -141,11 +164,11 @@ async def test_chat_with_gemini_calls_moderation():
 
 async def test_chat_with_gemini_blocks_flagged_content():
     """Verify that flagged content is blocked and not sent to AI"""
-    with patch('multimodal_moderation.gradio_app.check_content_safety') as mock_moderation:
+    with patch('multimodal_moderation.types.gradio_app.check_content_safety') as mock_moderation:
         # Mock failed moderation
         mock_moderation.return_value = (False, "Content flagged: unfriendly", "text/plain")
 
-        with patch('multimodal_moderation.gradio_app.customer_agent.run') as mock_agent:
+        with patch('multimodal_moderation.types.gradio_app.customer_agent.run') as mock_agent:
             message = {"text": "Inappropriate message"}
             history = []
             past_messages = []
@@ -160,3 +183,212 @@ async def test_chat_with_gemini_blocks_flagged_content():
             # Verify feedback contains warning
             assert "flagged" in feedback.lower(), \
                 "Feedback should indicate content was flagged"
+
+
+async def test_check_content_safety_caches_repeated_text():
+    """Verify that moderating the same text twice only calls the moderation API once"""
+    gradio_app._moderation_cache.clear()
+
+    mock_response = _mock_moderation_response(SAFE_TEXT_RESULT)
+
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock(return_value=mock_response)) as mock_post:
+        first = await gradio_app.check_content_safety(text="How can I help you today?")
+        second = await gradio_app.check_content_safety(text="How can I help you today?")
+
+    assert first == second, "Cached moderation should return the same result"
+    assert mock_post.call_count == 1, \
+        "Repeated content should be served from the moderation cache"
+
+
+async def test_multiple_inputs_are_moderated_in_one_batch_request():
+    """Verify that a turn with several inputs sends a single batch moderation request"""
+    gradio_app._moderation_cache.clear()
+
+    mock_response = _mock_moderation_response([SAFE_TEXT_RESULT, SAFE_TEXT_RESULT])
+
+    with patch.object(gradio_app, '_batch_endpoint_available', True), \
+            patch.object(gradio_app._http_client, 'post', new=AsyncMock(return_value=mock_response)) as mock_post:
+        moderated = await gradio_app._moderate_turn_inputs(["Hello there", "How can I help?"], [])
+
+    assert mock_post.call_count == 1, "All inputs should be moderated with a single request"
+    assert mock_post.call_args.args[0] == gradio_app.BATCH_MODERATION_ENDPOINT
+    assert [part for part, _ in moderated] == ["Hello there", "How can I help?"], \
+        "Prompt parts should be returned in input order"
+
+
+async def test_trivial_text_skips_moderation_api():
+    """Verify that greetings and near-empty messages are not sent to the moderation API"""
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock()) as mock_post:
+        for text in ["Hello.", "ok", "  hi ", "?"]:
+            is_safe, feedback, mime_type = await gradio_app.check_content_safety(text=text)
+            assert is_safe, f"'{text}' should be considered safe"
+
+    assert not mock_post.called, "Trivial text should not call the moderation API"
+
+
+async def test_short_emoji_is_still_moderated():
+    """Verify that a short but potentially rude message is sent to the moderation API"""
+    gradio_app._moderation_cache.clear()
+
+    mock_response = _mock_moderation_response({
+        "is_unfriendly": True,
+        "is_unprofessional": True,
+        "contains_pii": False,
+        "rationale": "Offensive gesture",
+    })
+
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock(return_value=mock_response)) as mock_post:
+        is_safe, feedback, mime_type = await gradio_app.check_content_safety(text="🖕")
+
+    assert mock_post.called, "Short non-ASCII messages should not skip moderation"
+    assert not is_safe, "The moderation verdict should be returned"
+
+
+def test_conversation_span_is_started_lazily():
+    """Verify that an idle session does not start a conversation span"""
+    chat_session = ChatSessionWithTracing()
+
+    assert chat_session.conversation_span is None, \
+        "The conversation span should only be started on the first message"
+
+    chat_session._get_conversation_context()
+    assert chat_session.conversation_span is not None
+
+    chat_session.end_conversation()
+    assert chat_session.conversation_span is None, \
+        "Ending the conversation should reset the span for the next conversation"
+
+
+async def test_batch_moderation_rejects_mismatched_result_count():
+    """Verify that a batch response with fewer results than inputs raises instead of truncating"""
+    gradio_app._moderation_cache.clear()
+
+    mock_response = _mock_moderation_response([SAFE_TEXT_RESULT])
+
+    with patch.object(gradio_app, '_batch_endpoint_available', True), \
+            patch.object(gradio_app._http_client, 'post', new=AsyncMock(return_value=mock_response)):
+        with pytest.raises(RuntimeError):
+            await gradio_app._moderate_turn_inputs(["Hello there", "How can I help?"], [])
+
+
+async def test_flagged_input_wins_over_other_moderation_errors():
+    """Verify that a flagged input is reported even if another input's moderation fails"""
+    async def moderate(*, text):
+        if text == "broken":
+            raise RuntimeError("moderation API unavailable")
+        return False, "Content flagged: unfriendly", "text/plain"
+
+    with patch.object(gradio_app, '_batch_endpoint_available', False), \
+            patch.object(gradio_app, 'check_content_safety', new=moderate):
+        with pytest.raises(gradio_app._ContentFlagged):
+            await gradio_app._moderate_turn_inputs(["broken", "rude message"], [])
+
+
+async def test_single_moderation_error_is_not_wrapped():
+    """Verify that a single moderation failure surfaces as itself, not as an ExceptionGroup"""
+    with patch.object(gradio_app, 'check_content_safety',
+                      new=AsyncMock(side_effect=RuntimeError("moderation API unavailable"))):
+        with pytest.raises(RuntimeError):
+            await gradio_app._moderate_turn_inputs(["How can I help?"], [])
+
+
+async def test_check_content_safety_reads_and_validates_media_path():
+    """Verify that moderating a file path without preloaded data detects its type and uploads it"""
+    gradio_app._moderation_cache.clear()
+    image_path = str(Path(__file__).parent / "test_data" / "simple_image.jpg")
+
+    mock_response = _mock_moderation_response({
+        "contains_pii": False,
+        "is_disturbing": False,
+        "is_low_quality": False,
+        "rationale": "Clear product photo",
+    })
+
+    with patch.object(gradio_app, '_record_media_in_background'), \
+            patch.object(gradio_app._http_client, 'post', new=AsyncMock(return_value=mock_response)) as mock_post:
+        is_safe, feedback, mime_type = await gradio_app.check_content_safety(media=image_path)
+
+    assert is_safe and mime_type == "image/jpeg"
+    assert mock_post.call_args.args[0] == gradio_app.MODERATION_CONFIG["image"]["endpoint"]
+
+
+async def test_post_moderation_retries_transient_errors():
+    """Verify that a transient 5xx is retried with backoff until the server responds"""
+    responses = [_mock_moderation_response({}, 503), _mock_moderation_response({}, 503),
+                 _mock_moderation_response(SAFE_TEXT_RESULT)]
+
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock(side_effect=responses)) as mock_post, \
+            patch.object(gradio_app.asyncio, 'sleep', new=AsyncMock()) as mock_sleep:
+        response = await gradio_app._post_moderation(gradio_app.MODERATION_CONFIG["text"]["endpoint"])
+
+    assert response is responses[-1], "The first non-retryable response should be returned"
+    assert mock_post.call_count == 3
+    assert [call.args[0] for call in mock_sleep.call_args_list] == \
+        [gradio_app.RETRY_BACKOFF_SECONDS, gradio_app.RETRY_BACKOFF_SECONDS * 2], \
+        "Retries should back off exponentially"
+
+
+async def test_post_moderation_returns_last_error_after_max_retries():
+    """Verify that retrying stops after MAX_RETRIES and the last 5xx is returned to the caller"""
+    responses = [_mock_moderation_response({}, 502) for _ in range(gradio_app.MAX_RETRIES + 1)]
+
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock(side_effect=responses)) as mock_post, \
+            patch.object(gradio_app.asyncio, 'sleep', new=AsyncMock()):
+        response = await gradio_app._post_moderation(gradio_app.MODERATION_CONFIG["text"]["endpoint"])
+
+    assert mock_post.call_count == gradio_app.MAX_RETRIES + 1, "The request should be retried MAX_RETRIES times"
+    assert response is responses[-1] and response.status_code == 502
+
+
+async def test_oversized_file_fails_turn_before_any_moderation(tmp_path):
+    """Verify that one oversized upload fails the whole turn before any moderation request is sent"""
+    image_path = str(Path(__file__).parent / "test_data" / "simple_image.jpg")
+    oversized_path = tmp_path / "oversized.jpg"
+    with open(oversized_path, "wb") as f:
+        # Sparse file: reports the size without writing the bytes
+        f.truncate(gradio_app.MAX_FILE_SIZE_BYTES + 1)
+
+    with patch.object(gradio_app._http_client, 'post', new=AsyncMock()) as mock_post:
+        with pytest.raises(ValueError, match="too large"):
+            await gradio_app._moderate_turn_inputs(["Here are my photos"], [image_path, str(oversized_path)])
+
+    assert not mock_post.called, "No moderation request should be sent when any file is too large"
+
+
+async def test_media_is_recorded_in_background_from_passed_bytes(tmp_path, monkeypatch):
+    """Verify that media is saved from the bytes already read, on a child span the task ends itself"""
+    monkeypatch.chdir(tmp_path)
+    data = b"uploaded image bytes"
+    parent = gradio_app.tracer.start_span("moderate_image")
+
+    started = []
+    start_span = gradio_app.tracer.start_span
+
+    def record_started_span(*args, **kwargs):
+        started.append(start_span(*args, **kwargs))
+        return started[-1]
+
+    with patch.object(gradio_app.tracer, 'start_span', new=record_started_span):
+        # The path does not exist, so the upload can only be saved from the passed bytes
+        gradio_app._record_media_in_background(parent, str(tmp_path / "gone.jpg"), data, "image_moderation", 0)
+        await asyncio.gather(*gradio_app._background_tasks)
+    parent.end()
+
+    (child,) = started
+    saved = list((tmp_path / "uploaded_media").iterdir())
+    assert [path.read_bytes() for path in saved] == [data], "The passed bytes should be written as-is"
+    assert child.end_time is not None, "The background task should end its child span"
+    assert child.parent.span_id == parent.get_span_context().span_id
+    assert child.attributes["input.image_moderation.0.size_bytes"] == len(data)
+
+
+def test_media_is_not_recorded_for_unsampled_spans():
+    """Verify that nothing is scheduled when the parent span is not being recorded"""
+    parent = trace.NonRecordingSpan(trace.INVALID_SPAN_CONTEXT)
+
+    with patch.object(gradio_app.tracer, 'start_span') as mock_start_span, \
+            patch.object(gradio_app.asyncio, 'create_task') as mock_create_task:
+        gradio_app._record_media_in_background(parent, "image.jpg", b"data", "image_moderation", 0)
+
+    assert not mock_start_span.called, "No child span should be started for an unsampled parent"
+    assert not mock_create_task.called, "No background task should be scheduled for an unsampled parent"
@@ -0,0 +1,139 @@
+"""
+Tests for video preprocessing before moderation.
+
+These tests verify that downsample_video shrinks large videos into a decodable,
+lower-resolution mp4, and leaves inputs it cannot or should not shrink untouched,
+so preprocessing never breaks a moderation request.
+"""
+
+import io
+from pathlib import Path
+
+import av
+import numpy as np
+import pytest
+
+from multimodal_moderation.video_preprocessing import (
+    downsample_video,
+    select_keyframes,
+    _scaled_size,
+    SMALL_VIDEO_BYTES,
+    MAX_LONG_EDGE,
+)
+
+
+def _load_test_video():
+    """Helper to load the test video as bytes"""
+    test_video_path = Path(__file__).parent / "test_data" / "simple_video.mp4"
+    with open(test_video_path, "rb") as f:
+        return f.read()
+
+
+def _make_large_video(width=640, height=480, fps=15, num_frames=30, with_audio=False):
+    """Helper to encode random-noise frames, optionally with a tone, into an mp4 well above SMALL_VIDEO_BYTES"""
+    rng = np.random.default_rng(0)
+    output = io.BytesIO()
+
+    with av.open(output, mode="w", format="mp4") as container:
+        stream = container.add_stream("libx264", rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.gop_size = fps
+
+        if with_audio:
+            sample_rate = 44100
+            audio_stream = container.add_stream("aac", rate=sample_rate)
+            seconds = num_frames / fps
+            tone = np.sin(2 * np.pi * 440 * np.arange(int(sample_rate * seconds)) / sample_rate)
+            audio_frame = av.AudioFrame.from_ndarray(
+                tone.astype(np.float32).reshape(1, -1), format="flt", layout="mono"
+            )
+            audio_frame.sample_rate = sample_rate
+            for packet in audio_stream.encode(audio_frame):
+                container.mux(packet)
+            for packet in audio_stream.encode():
+                container.mux(packet)
+
+        for _ in range(num_frames):
+            pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(pixels, format="rgb24")):
+                container.mux(packet)
+
+        for packet in stream.encode():
+            container.mux(packet)
+
+    return output.getvalue()
+
+
+def test_large_video_is_downsampled():
+    """Verify that a large video becomes a smaller, decodable mp4 within MAX_LONG_EDGE"""
+    video_bytes = _make_large_video()
+    assert len(video_bytes) > SMALL_VIDEO_BYTES
+
+    result, media_type = downsample_video(video_bytes, "video/mp4")
+
+    assert media_type == "video/mp4", "Downsampled videos are re-encoded as mp4"
+    assert len(result) < len(video_bytes), "Downsampled video should be smaller than the original"
+
+    with av.open(io.BytesIO(result)) as container:
+        stream = container.streams.video[0]
+        frames = list(container.decode(stream))
+
+    assert frames, "Downsampled video should decode to at least one frame"
+    assert max(frames[0].width, frames[0].height) <= MAX_LONG_EDGE, \
+        f"Downsampled frames should be at most {MAX_LONG_EDGE}px on the long edge"
+
+
+def test_downsampled_video_keeps_audio():
+    """Verify that the audio track survives downsampling, since speech is part of what gets moderated"""
+    video_bytes = _make_large_video(with_audio=True)
+
+    with av.open(io.BytesIO(video_bytes)) as container:
+        assert container.streams.audio, "Test video should have an audio stream"
+
+    result, media_type = downsample_video(video_bytes, "video/mp4")
+
+    assert result is not video_bytes, "Large video with audio should still be downsampled"
+    with av.open(io.BytesIO(result)) as container:
+        assert container.streams.video, "Downsampled video should keep a video stream"
+        assert container.streams.audio, "Downsampled video should keep the audio stream"
+        assert list(container.decode(container.streams.audio[0])), "Audio stream should decode"
+
+
+def test_scaled_size_rejects_missing_dimensions():
+    """Verify that a stream without dimensions raises ValueError, which downsample_video catches"""
+    with pytest.raises(ValueError):
+        _scaled_size(0, 0)
+
+
+def test_small_video_is_not_preprocessed():
+    """Verify that videos below SMALL_VIDEO_BYTES are returned unchanged"""
+    video_bytes = _load_test_video()
+    assert len(video_bytes) < SMALL_VIDEO_BYTES
+
+    result, media_type = downsample_video(video_bytes, "video/mp4")
+
+    assert result is video_bytes, "Small videos should bypass preprocessing"
+    assert media_type == "video/mp4", "Media type should be unchanged for small videos"
+
+
+def test_undecodable_video_falls_back_to_original():
+    """Verify that data which cannot be decoded is returned unchanged"""
+    garbage = b"\x00" * (SMALL_VIDEO_BYTES + 1)
+
+    result, media_type = downsample_video(garbage, "video/webm")
+
+    assert result is garbage, "Undecodable input should be returned as-is"
+    assert media_type == "video/webm", "Media type should be unchanged on fallback"
+
+
+def test_select_keyframes_drops_duplicate_frames():
+    """Verify that only frames differing from the last retained frame are kept"""
+    frames = np.zeros((4, 8, 8, 3), dtype=np.uint8)
+    frames[2:] = 255
+
+    keep = select_keyframes(frames, 8.0)
+
+    assert keep.tolist() == [True, False, True, False], \
+        "Only the first frame and the first frame after a scene change should be kept"